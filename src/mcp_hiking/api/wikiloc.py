@@ -1,44 +1,222 @@
 """Wikiloc API integration for fetching hiking trails."""
-from typing import Any, List, Tuple
+from typing import Any
+import asyncio
 import base64
-import json
+import functools
+import re
+import sys
+import time
+from collections import OrderedDict
 from pathlib import Path
 
+from xml.sax.saxutils import escape
+
+import diskcache
 import httpx
-import simplekml
+import numpy as np
+import orjson
 import wkbparse
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
 
 # Constants
 WIKILOC_API_BASE = "https://es.wikiloc.com/wikiloc/find.do"
 GOOGLE_MAPS_LOCATION = "https://www.google.com/maps/search/?api=1&query="
 USER_AGENT = "wikiloc-app/1.0"
+# Cap on concurrent requests to stay polite to Wikiloc
+_fetch_semaphore = asyncio.Semaphore(8)
+
+# Shared HTTP client, created lazily so it binds to the running event loop
+_client: httpx.AsyncClient | None = None
+
+# In-memory LRU cache for Wikiloc responses, keyed by (url, params)
+CACHE_TTL = 3600.0  # seconds
+CACHE_MAX_SIZE = 512
+_response_cache: OrderedDict[tuple, tuple[float, bytes | dict[str, Any]]] = OrderedDict()
+_cache_lock = asyncio.Lock()
+
+# On-disk cache so server restarts don't re-fetch or re-parse known pages.
+# Trail statistics change rarely, so a long TTL is safe; search rankings
+# shift more often and get a shorter one.
+DISK_CACHE_DIR = Path.home() / ".cache" / "mcp_hiking" / "wikiloc"
+DETAILS_CACHE_TTL = 7 * 86400  # seconds
+SEARCH_CACHE_TTL = 3600  # seconds
+_disk_cache: diskcache.Cache | None = None
+
+def _get_disk_cache() -> diskcache.Cache:
+    """Return the on-disk cache, creating its directory on first use."""
+    global _disk_cache
+    if _disk_cache is None:
+        _disk_cache = diskcache.Cache(str(DISK_CACHE_DIR))
+    return _disk_cache
+
+async def _disk_cache_get(key):
+    """Read from the disk cache in a worker thread (sqlite I/O blocks)."""
+    return await asyncio.to_thread(_get_disk_cache().get, key)
+
+async def _disk_cache_set(key, value, expire: float) -> None:
+    """Write to the disk cache in a worker thread (sqlite I/O blocks)."""
+    await asyncio.to_thread(_get_disk_cache().set, key, value, expire=expire)
+
+# Matches the trail-data section so only that fragment needs a DOM parse
+_trail_data_re = re.compile(rb'<section[^>]*id="trail-data".*?</section>', re.S)
+
+# Matches the inline mapData JSON blob on route pages
+_mapdata_re = re.compile(rb"var\s+mapData\s*=\s*(\{.*?\});", re.S)
+
+# The statistic labels format_trail consumes, interned so the per-item
+# membership test is an O(1) hash with pointer-equality comparison
+TRAIL_STAT_KEYS = frozenset(map(sys.intern, (
+    "Distancia",
+    "Desnivel positivo",
+    "Desnivel negativo",
+    "Dificultad técnica",
+    "Altitud máxima",
+    "Altitud mínima",
+    "TrailRank",
+    "Tipo de ruta"
+)))
+
+# Restricts tree building to the trail-data section, so even when the
+# regex pre-slice misses we never materialize the whole page as a DOM
+_trail_data_strainer = SoupStrainer("section", id="trail-data")
+
+# Normalizes the odd whitespace Wikiloc uses in statistic values
+_whitespace_table = str.maketrans({"\xa0": " ", "\u2009": " ", "\u200b": ""})
+
+# KML skeleton: the structure is fixed, only the trail data varies
+_KML_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+  <Document>
+    <Style id="trail">
+      <LineStyle>
+        <color>ff0000ff</color>
+        <width>3</width>
+      </LineStyle>
+    </Style>
+    <Placemark>
+      <name>{name}</name>
+      <description>Hiking trail from WikiLoc</description>
+      <styleUrl>#trail</styleUrl>
+      <LineString>
+        <coordinates>{coordinates}</coordinates>
+      </LineString>
+    </Placemark>{markers}
+  </Document>
+</kml>
+"""
+
+_KML_MARKER_TEMPLATE = """
+    <Placemark>
+      <name>{name}</name>
+      <description>{description}</description>
+      <Point>
+        <coordinates>{coordinate}</coordinates>
+      </Point>
+    </Placemark>"""
+# Keys and values are interned so lookups across thousands of routes
+# reduce to pointer comparisons and share one copy of each string
 difficulty_translation = {
-        "Fácil": "Easy",
-        "Moderado": "Moderate",
-        "Difícil": "Hard",
-        "Muy Difícil": "Very Hard",
-        "Solo expertos": "Experts Only"
+        sys.intern("Fácil"): sys.intern("Easy"),
+        sys.intern("Moderado"): sys.intern("Moderate"),
+        sys.intern("Difícil"): sys.intern("Hard"),
+        sys.intern("Muy Difícil"): sys.intern("Very Hard"),
+        sys.intern("Solo expertos"): sys.intern("Experts Only")
 }
 
-async def make_wikiloc_request(url: str, params: dict) -> str | dict[str, Any] | None:
-    """Make a request to Wikiloc and return either HTML or JSON based on response."""
-    headers = {
-        "User-Agent": USER_AGENT
-    }
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, headers=headers, params=params, timeout=30.0)
-            response.raise_for_status()
-            
-            content_type = response.headers.get("Content-Type", "")
-            if "application/json" in content_type:
-                return response.json()
-            else:
-                return response.text  # HTML or other format
-        except Exception as e:
-            print(f"Error in request: {e}")
-            return None
+def get_client() -> httpx.AsyncClient:
+    """Return the shared HTTP client, creating it on first use.
+
+    Reusing a single client keeps connections alive between requests,
+    avoiding a fresh TCP+TLS handshake per call.
+    """
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=30.0,
+            headers={"User-Agent": USER_AGENT, "Accept-Encoding": "br, gzip"},
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            http2=True
+        )
+    return _client
+
+async def aclose() -> None:
+    """Close the shared HTTP client and its pooled connections."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def _is_retryable_error(exc: BaseException) -> bool:
+    """Retry transport failures, rate limits and server-side errors only."""
+    if isinstance(exc, httpx.TransportError):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status == 429 or status >= 500
+    return False
+
+_backoff = wait_exponential(min=0.5, max=8)
+
+def _retry_wait(retry_state) -> float:
+    """Honor Retry-After on 429 responses, otherwise back off exponentially."""
+    exc = retry_state.outcome.exception()
+    if isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code == 429:
+        retry_after = exc.response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return float(retry_after)
+    return _backoff(retry_state)
+
+@retry(stop=stop_after_attempt(3), wait=_retry_wait,
+       retry=retry_if_exception(_is_retryable_error), reraise=True)
+async def _get_response(url: str, params: dict) -> httpx.Response:
+    async with _fetch_semaphore:
+        response = await get_client().get(url, params=params)
+    response.raise_for_status()
+    return response
+
+async def make_wikiloc_request(url: str, params: dict) -> bytes | dict[str, Any] | None:
+    """Make a request to Wikiloc and return either HTML bytes or parsed JSON.
+
+    HTML is returned undecoded: both the statistics and geometry
+    extractors work on raw bytes, so decoding whole pages to str here
+    would just be an extra copy.
+
+    Responses are cached in memory so repeated queries for the same URL
+    (e.g. get_trail_geometry after get_trails) skip the network entirely.
+    """
+    key = (url, tuple(sorted(params.items())))
+    async with _cache_lock:
+        cached = _response_cache.get(key)
+        if cached is not None:
+            timestamp, result = cached
+            if time.monotonic() - timestamp < CACHE_TTL:
+                _response_cache.move_to_end(key)
+                return result
+            del _response_cache[key]
+
+    try:
+        response = await _get_response(url, params)
+
+        content_type = response.headers.get("Content-Type", "")
+        if "application/json" in content_type:
+            result = orjson.loads(response.content)
+        else:
+            result = response.content  # HTML or other format, undecoded
+    except Exception as e:
+        print(f"Error in request: {e}")
+        return None
+
+    async with _cache_lock:
+        _response_cache[key] = (time.monotonic(), result)
+        _response_cache.move_to_end(key)
+        while len(_response_cache) > CACHE_MAX_SIZE:
+            _response_cache.popitem(last=False)
+    return result
+
+def _trailrank_key(spa: dict) -> float:
+    """Sort key for ranking search entries by TrailRank (missing rank sorts last)."""
+    return float(spa.get("trailrank") or 0)
 
 def format_trail(trail: dict) -> str:
     """Format a trail feature into a readable string with the new keys."""
@@ -56,104 +234,136 @@ Minimum altitude: {trail['Altitud mínima']}
 Trail type: {trail['Tipo de ruta']}
 """
 
-def extract_trail_statistics(html: str) -> dict:
-    """Extracts trail statistics from Wikiloc HTML."""
-    soup = BeautifulSoup(html, "html.parser")
+def _ensure_bytes(html: str | bytes) -> bytes:
+    """Accept either decoded or raw HTML; the extractors work on bytes."""
+    return html.encode("utf-8") if isinstance(html, str) else html
+
+def format_trails(trails: list[dict]) -> str:
+    """Format a batch of trail dicts into the tool's reply in one pass."""
+    return "\n---\n".join(map(format_trail, trails))
+
+def extract_trail_statistics(html: str | bytes) -> dict:
+    """Extracts trail statistics from Wikiloc HTML.
+
+    Results are memoized per page so repeated lookups skip the parse.
+    """
+    return dict(_parse_trail_statistics(_ensure_bytes(html)))
+
+@functools.lru_cache(maxsize=128)
+def _parse_trail_statistics(html: bytes) -> dict:
+    # Slice out the trail-data section first so BeautifulSoup only has to
+    # build a tree for that fragment instead of the whole page
+    match = _trail_data_re.search(html)
+    if match:
+        html = match.group(0)
+    soup = BeautifulSoup(html, "lxml", parse_only=_trail_data_strainer)
     section = soup.find("section", id="trail-data")
 
     if not section:
         return {}
 
     data = {}
-    for item in section.select("dl.data-items .d-item"):
+    for item in section.find_all(class_="d-item"):
         dt = item.find("dt")
         dd = item.find("dd")
         if not (dt and dd):
             continue
 
-        key = dt.get_text(strip=True).replace('\xa0', ' ')
+        key = dt.get_text(strip=True).translate(_whitespace_table)
 
         # Special case: TrailRank
         if "TrailRank" in key:
             # Look for just the first <span> with number
             first_span = dd.find("span")
-            value = first_span.get_text(strip=True) if first_span else ''
-        else:
+            data["TrailRank"] = first_span.get_text(strip=True) if first_span else ''
+        elif key in TRAIL_STAT_KEYS:
             # For other cases, extract all text from dd
-            value = dd.get_text(strip=True).replace('\xa0', ' ')
-
-        data[key] = value
+            data[key] = dd.get_text(strip=True).translate(_whitespace_table)
 
     return data
 
-def extract_geometry(html: str) -> dict:
+def extract_geometry(html: str | bytes) -> dict:
     """Extract the geometry data from the Wikiloc HTML."""
-    lines = html.split("\n")
-    for line in lines:
-        if "var mapData =" in line:
-            try:
-                # Find the JSON object
-                start = line.find("=") + 1
-                json_str = line[start:].strip().rstrip(";")
-                data = json.loads(json_str)
-                
-                # Decode base64 geometry
-                twkb_geom = base64.b64decode(data["mapData"][0]["geom"])
-                
-                # Get trail name
-                slug = Path(data["mapData"][0]["prettyURL"]).stem
-                name = data["mapData"][0]["nom"]
-                start_url = f"{GOOGLE_MAPS_LOCATION}{data['mapData'][0]['blat']},{data['mapData'][0]['blng']}"
-                end_url = f"{GOOGLE_MAPS_LOCATION}{data['mapData'][0]['elat']},{data['mapData'][0]['elng']}"
-                
-                # Parse TWKB to GeoJSON
-                geojson = wkbparse.twkb_to_geojson(twkb_geom)
-                
-                # Extract coordinates from GeoJSON LineString
-                coords = []
-                if geojson["type"] == "LineString":
-                    coords = [(coord[0],coord[1], coord[2]) for coord in geojson["coordinates"]]
-                    
-                return {
-                    "name": name,
-                    "slug": slug,
-                    "coordinates": coords,
-                    "start_url": start_url,
-                    "end_url": end_url
-                }
-            except (json.JSONDecodeError, KeyError, IndexError, base64.binascii.Error) as e:
-                print(f"Error extracting geometry: {e}")
-                continue
-            
-    return {}
-
-def create_kml(name: str, slug: str, coordinates: List[Tuple[float, float, float]]):
-    """Create a KML file from a list of coordinates."""
-    
-    kml = simplekml.Kml()
-     # Create trail style
-    trail_style = simplekml.Style()
-    trail_style.linestyle.color = 'ff0000ff'  # Red color
-    trail_style.linestyle.width = 3
-
-    # Create placemark for the trail
-    trail = kml.newlinestring(name=name, description='Hiking trail from WikiLoc')
-    trail.coords = coordinates
-    trail.style = trail_style
-    
+    match = _mapdata_re.search(_ensure_bytes(html))
+    if not match:
+        return {}
+
+    try:
+        # Parse the JSON object
+        data = orjson.loads(match.group(1))
+
+        # Decode base64 geometry
+        twkb_geom = base64.b64decode(data["mapData"][0]["geom"])
+
+        # Get trail name
+        slug = Path(data["mapData"][0]["prettyURL"]).stem
+        name = data["mapData"][0]["nom"]
+        start_url = f"{GOOGLE_MAPS_LOCATION}{data['mapData'][0]['blat']},{data['mapData'][0]['blng']}"
+        end_url = f"{GOOGLE_MAPS_LOCATION}{data['mapData'][0]['elat']},{data['mapData'][0]['elng']}"
+
+        # Parse TWKB to GeoJSON with wkbparse's compiled decoder
+        geojson = wkbparse.twkb_to_geojson(twkb_geom)
+
+        # Convert the points to an (N, 3) lon/lat/alt array in one C call,
+        # dropping the per-point timestamp column Wikiloc appends
+        coords = np.empty((0, 3), dtype=np.float64)
+        if geojson["type"] == "LineString":
+            arr = np.asarray(geojson["coordinates"], dtype=np.float64)
+            if arr.ndim != 2 or arr.shape[1] < 3:
+                # Altitude-less or ragged tracks can't feed the KML writer
+                return {}
+            coords = arr[:, :3]
+
+        return {
+            "name": name,
+            "slug": slug,
+            "coordinates": coords,
+            "start_url": start_url,
+            "end_url": end_url
+        }
+    except (orjson.JSONDecodeError, KeyError, IndexError, base64.binascii.Error) as e:
+        print(f"Error extracting geometry: {e}")
+        return {}
+
+def _format_coordinate(coordinate) -> str:
+    """Format a single (lon, lat, alt) point as KML coordinate text."""
+    lon, lat, alt = coordinate
+    # ~11cm precision for lon/lat, decimeter for altitude — plenty for
+    # hiking tracks and much shorter than repr'ing full float64 digits
+    return "%.6f,%.6f,%.1f" % (lon, lat, alt)
+
+def create_kml(name: str, slug: str, coordinates: np.ndarray, output_dir: Path = Path("routes")):
+    """Create a KML file under output_dir from an (N, 3) array of coordinates.
+
+    The KML is emitted from a fixed template in a single pass instead of
+    building an intermediate object graph, which dominates runtime for
+    long tracks.
+    """
+    coord_text = "\n".join(_format_coordinate(coord) for coord in coordinates)
+
     # Create start and end markers if we have coordinates
-    if coordinates:
-        # Start marker
-        start = kml.newpoint(name='Start', description='Starting point')
-        start.coords = [(coordinates[0][0], coordinates[0][1], coordinates[0][2])]
-        
-        # End marker
-        end = kml.newpoint(name='End', description='End point')
-        end.coords = [(coordinates[-1][0], coordinates[-1][1], coordinates[-1][2])]
-    
-    # Save KML file
-    kml_path = Path("routes") / f"{slug}.kml"
-    kml.save(kml_path)
+    markers = ""
+    if len(coordinates):
+        markers += _KML_MARKER_TEMPLATE.format(
+            name="Start",
+            description="Starting point",
+            coordinate=_format_coordinate(coordinates[0])
+        )
+        markers += _KML_MARKER_TEMPLATE.format(
+            name="End",
+            description="End point",
+            coordinate=_format_coordinate(coordinates[-1])
+        )
+
+    kml = _KML_TEMPLATE.format(
+        name=escape(name),
+        coordinates=coord_text,
+        markers=markers
+    )
+
+    # Save KML file: encode up front and write the whole buffer at once
+    kml_path = output_dir / f"{slug}.kml"
+    kml_path.write_bytes(kml.encode("utf-8"))
     return kml_path.absolute()
 
 async def search_trails(query: str, sw_lat: float, sw_lon: float, ne_lat: float, ne_lon: float, page: int = 1, max_results: int = 5) -> str:
@@ -171,6 +381,11 @@ async def search_trails(query: str, sw_lat: float, sw_lon: float, ne_lat: float,
     Returns:
         A formatted string containing the routes found.
     """
+    search_key = ("search", query, sw_lat, sw_lon, ne_lat, ne_lon, page, max_results)
+    cached = await _disk_cache_get(search_key)
+    if cached is not None:
+        return cached
+
     params = {
         "event": "map",
         "to": 25,
@@ -190,10 +405,14 @@ async def search_trails(query: str, sw_lat: float, sw_lon: float, ne_lat: float,
     if not data["spas"]:
         return "No trails found for this search."
 
-    # Extract and sort the trails by TrailRank (descending order)
+    # Sort by TrailRank (descending) and only keep the top results, so
+    # detail pages are fetched just for the trails we actually return
+    top_spas = sorted(data["spas"], key=_trailrank_key, reverse=True)[:max_results]
+
+    # Build the trail entries for the top results
     trails = []
-    for spa in data["spas"]:
-        trail = {
+    for spa in top_spas:
+        trails.append({
             "title": spa["name"],
             "url": f"https://es.wikiloc.com{spa['prettyURL']}",
             "distance_km": spa.get("distance"),
@@ -201,18 +420,36 @@ async def search_trails(query: str, sw_lat: float, sw_lon: float, ne_lat: float,
             "author": spa.get("author"),
             "location": spa.get("near"),
             "trailrank": spa.get("trailrank")
-        }
-        
-        # Obtain the route details (HTML response)
-        response = await make_wikiloc_request(trail["url"], {})
-        if isinstance(response, str):  # Ensure we got HTML response
+        })
+
+    # Fetch and parse the route detail pages concurrently, reusing the
+    # on-disk cache so known routes skip both the fetch and the parse
+    async def fetch_details(url: str) -> dict | None:
+        details = await _disk_cache_get(url)
+        if details is not None:
+            return details
+        response = await make_wikiloc_request(url, {})
+        if isinstance(response, bytes):  # Ensure we got HTML response
             details = extract_trail_statistics(response)
+            await _disk_cache_set(url, details, expire=DETAILS_CACHE_TTL)
+            return details
+        return None
+
+    responses = await asyncio.gather(
+        *(fetch_details(trail["url"]) for trail in trails),
+        return_exceptions=True
+    )
+
+    for trail, details in zip(trails, responses):
+        if isinstance(details, dict):
             # Add details to the 'trail' dictionary
             trail.update(details)
-        
-        trails.append(trail)
 
     # Format the top results
-    top_trails = [format_trail(trail) for trail in trails[:max_results]]
-    
-    return "\n---\n".join(top_trails)
+    result = format_trails(trails)
+    await _disk_cache_set(search_key, result, expire=SEARCH_CACHE_TTL)
+    return result
+
+# Historical name for search_trails; kept as a thin alias so both spellings
+# resolve to the single implementation (and share its module-level caches)
+search_routes = search_trails
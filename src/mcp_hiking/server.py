@@ -1,12 +1,37 @@
 """Model Context Protocol (MCP) server implementation for hiking trails."""
+import asyncio
 import os
+from contextlib import asynccontextmanager
+from pathlib import Path
 from textwrap import dedent
 from dataclasses import dataclass
 from mcp.server.fastmcp import FastMCP
 from mcp_hiking.api import wikiloc
 
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    """Release the pooled Wikiloc connections while the loop is still running."""
+    try:
+        yield
+    finally:
+        await wikiloc.aclose()
+
 # Initialize FastMCP server
-mcp = FastMCP("wikiloc")
+mcp = FastMCP("wikiloc", lifespan=lifespan)
+
+@dataclass(slots=True, frozen=True)
+class GeometryResponse:
+    """Result of a geometry extraction: KML path plus start/end map links."""
+    kml_path: str
+    start_url: str | None
+    end_url: str | None
+
+    def __str__(self) -> str:
+        return dedent(f"""
+            KML file: {self.kml_path}
+            Start url: {self.start_url}
+            End url: {self.end_url}
+            """)
 
 @mcp.tool()
 async def get_trails(query: str, sw_lat: float, sw_lon: float, ne_lat: float, ne_lon: float, page: int = 1, max_results: int = 5) -> str:
@@ -44,9 +69,9 @@ async def get_trail_geometry(trail_url: str) -> str:
     # if not route_url.startswith("https://es.wikiloc.com/"):
     #     raise ValueError("Invalid Wikiloc URL. Must be a URL from es.wikiloc.com")
     
-    # Get the HTML content
+    # Get the HTML content (raw bytes; the extractor handles decoding)
     html = await wikiloc.make_wikiloc_request(trail_url, {})
-    if not isinstance(html, str):
+    if not isinstance(html, bytes):
         raise ValueError("Failed to fetch trail data")
         
     # Extract geometry
@@ -54,23 +79,21 @@ async def get_trail_geometry(trail_url: str) -> str:
     if not geometry:
         raise ValueError("No trail geometry found")
         
-    # Create routes directory in current working directory if it doesn't exist
-    output_dir = "routes"
-    os.makedirs(output_dir, exist_ok=True)
+    # Create the output directory if it doesn't exist; HIKING_KML_DIR
+    # overrides the default routes/ directory in the cwd
+    output_dir = Path(os.environ.get("HIKING_KML_DIR", "routes"))
+    await asyncio.to_thread(os.makedirs, output_dir, exist_ok=True)
 
     # Extract start and end urls
     start_url = geometry.pop("start_url", None)
     end_url = geometry.pop("end_url", None)
 
-    # Create KML file
-    kml_path = wikiloc.create_kml(**geometry)
+    # Create KML file in a worker thread so the disk write does not block
+    # the event loop for other in-flight requests
+    kml_path = await asyncio.to_thread(wikiloc.create_kml, output_dir=output_dir, **geometry)
     
-    # Return response with KML path and coordinates
-    return dedent(f"""
-        KML file: {kml_path}
-        Start url: {start_url}
-        End url: {end_url}
-        """)
+    # Return response with KML path and start/end links
+    return str(GeometryResponse(str(kml_path), start_url, end_url))
 
 def main():
     """Main function to run the server."""
@@ -1,30 +1,38 @@
 """Tests for the Wikiloc API integration."""
-import pytest
 import httpx
 from bs4 import BeautifulSoup
 from mcp_hiking.api import wikiloc
 
-@pytest.mark.asyncio
-async def test_make_wikiloc_request(mock_wikiloc_response, respx_mock):
+async def test_make_wikiloc_request(mock_wikiloc_response, wikiloc_client):
     """Test making requests to the Wikiloc API."""
     url = "https://es.wikiloc.com/wikiloc/find.do"
-    respx_mock.get(url).mock(return_value=httpx.Response(
+    wikiloc_client(lambda request: httpx.Response(
         status_code=200,
         json=mock_wikiloc_response,
         headers={"Content-Type": "application/json"}
     ))
-    
+
     result = await wikiloc.make_wikiloc_request(url, {})
     assert result == mock_wikiloc_response
 
 def test_extract_trail_statistics(mock_trail_statistics_html):
     """Test extracting trail statistics from HTML."""
     stats = wikiloc.extract_trail_statistics(mock_trail_statistics_html)
-    
+
     assert stats["Dificultad técnica"] == "Moderado"
     assert stats["Distancia"] == "10.5 km"
     assert stats["Desnivel positivo"] == "500 m"
 
+    # A repeat call is served from the memoized parse
+    hits_before = wikiloc._parse_trail_statistics.cache_info().hits
+    repeat = wikiloc.extract_trail_statistics(mock_trail_statistics_html)
+    assert wikiloc._parse_trail_statistics.cache_info().hits == hits_before + 1
+
+    # ... and each call gets a fresh copy, so mutating the result
+    # cannot poison the cached entry
+    assert repeat == stats
+    assert repeat is not stats
+
 def test_format_trail():
     """Test formatting a trail into a readable string."""
     trail = {
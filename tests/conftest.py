@@ -1,8 +1,24 @@
 """Shared pytest fixtures for testing."""
+import httpx
 import pytest
-from httpx import AsyncClient
+
+from mcp_hiking.api import wikiloc
 
 @pytest.fixture
+def wikiloc_client(monkeypatch):
+    """Install a MockTransport-backed client as the shared wikiloc client.
+
+    Returns a callable taking an httpx handler function; dispatch goes
+    through a single function call per request instead of respx's route
+    registry, and the module-level client is restored on teardown.
+    """
+    def _install(handler):
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(wikiloc, "_client", client)
+        return client
+    return _install
+
+@pytest.fixture(scope="session")
 def mock_wikiloc_response():
     """Sample Wikiloc API response for testing."""
     return {
@@ -19,7 +35,7 @@ def mock_wikiloc_response():
         ]
     }
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def mock_trail_statistics_html():
     """Sample trail statistics HTML section for testing extract_trail_statistics."""
     return '''
@@ -41,8 +57,8 @@ def mock_trail_statistics_html():
     </section>
     '''
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def mock_trail_html():
-    """Load sample trail HTML with geometry data for testing."""
+    """Load sample trail HTML with geometry data for testing (read once per run)."""
     with open('tests/resources/trail.html', 'r', encoding='utf-8') as f:
         return f.read()
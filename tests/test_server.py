@@ -1,15 +1,19 @@
 """Tests for the MCP server functionality."""
-import os
-import pytest
+import re
+from pathlib import Path
 import httpx
 from mcp_hiking.server import get_trail_geometry
 
-@pytest.mark.asyncio
-async def test_get_trail_geometry(mock_trail_html, respx_mock):
+_KML_PATH_RE = re.compile(r'KML file: (.+\.kml)')
+
+async def test_get_trail_geometry(mock_trail_html, wikiloc_client, tmp_path, monkeypatch):
     """Test extracting trail geometry and generating KML."""
+    # Write the KML into the per-test tmp_path so no cleanup is needed
+    monkeypatch.setenv("HIKING_KML_DIR", str(tmp_path))
+
     # Mock the API request
     url = "https://es.wikiloc.com/rutas-senderismo/test-trail"
-    respx_mock.get(url).mock(return_value=httpx.Response(
+    wikiloc_client(lambda request: httpx.Response(
         status_code=200,
         text=mock_trail_html,
         headers={"Content-Type": "text/html"}
@@ -20,24 +24,17 @@ async def test_get_trail_geometry(mock_trail_html, respx_mock):
 
     # Verify the response is correct
     assert isinstance(result, str)
-    assert "KML file: routes/" in result
-    assert ".kml" in result
+    assert "KML file:" in result
     assert "Start url:" in result
     assert "End url:" in result
 
     # Extract the KML file path from the result
-    import re
-    kml_path = re.search(r'KML file: (.+\.kml)', result).group(1)
-    
-    # Verify the KML file was created
-    assert os.path.exists(kml_path)
-    with open(kml_path, 'r') as f:
-        kml_content = f.read()
-        assert '<?xml version="1.0" encoding="UTF-8"?>' in kml_content
-        assert '<kml' in kml_content
-        assert '<coordinates>' in kml_content
+    kml_path = Path(_KML_PATH_RE.search(result).group(1))
 
-    # Clean up the test file
-    os.remove(kml_path)
-    if not os.listdir('routes'):
-        os.rmdir('routes')
\ No newline at end of file
+    # Verify the KML file was created in the configured directory
+    assert kml_path.is_relative_to(tmp_path)
+    assert kml_path.exists()
+    kml_content = kml_path.read_text()
+    assert '<?xml version="1.0" encoding="UTF-8"?>' in kml_content
+    assert '<kml' in kml_content
+    assert '<coordinates>' in kml_content